@@ -98,6 +98,7 @@ from .scipy.bigmodel import BigModel
 from .skmaxent import (FeatureTransformer,
                        MinDivergenceModel,
                        MCMinDivergenceModel)
+from . import samplers
 
 
 __all__ = ['BaseModel',
@@ -105,6 +106,7 @@ __all__ = ['BaseModel',
            'ConditionalModel',
            'BigModel',
            'utils',
+           'samplers',
            'FeatureTransformer',
            'MinDivergenceModel',
            'MCMinDivergenceModel']
@@ -104,6 +104,10 @@ class BaseModel(six.with_metaclass(ABCMeta)):
         self.external = None
         self.external_priorlogprobs = None
 
+        # Interim results of computations depending on the parameters and
+        # the sample.  These are None until computed.  See clearcache().
+        self.clearcache()
+
 
     def fit(self, X, y=None):
         """Fit the model of minimum divergence / maximum entropy subject to
@@ -473,24 +477,38 @@ class BaseModel(six.with_metaclass(ABCMeta)):
         """Set the parameter vector to params, replacing the existing
         parameters.  params must be a list or numpy array of the same
         length as the model's feature vector f.
+
+        If params equals the existing parameters, the cached estimates are
+        kept.  Call clearcache() after changing anything else they depend
+        on.
         """
 
+        # Optimizers often evaluate the dual and gradient at the same point
+        # in turn, calling setparams() each time with an equal copy of the
+        # params.  (If params *is* self.params, it may have been modified
+        # in place.)
+        unchanged = (hasattr(self, 'params') and params is not self.params
+                     and np.array_equal(params, self.params))
+
         self.params = np.array(params, float)        # make a copy
 
         # Log the new params to disk
         self.logparams()
 
         # Delete params-specific stuff
-        self.clearcache()
+        if not unchanged:
+            self.clearcache()
 
 
     def clearcache(self):
         """Clears the interim results of computations depending on the
         parameters and the sample.
         """
-        for var in ['mu', 'logZ', 'logZapprox', 'logv']:
-            if hasattr(self, var):
-                delattr(self, var)
+        self.mu = None
+        self.logZ = None
+        self.logZapprox = None
+        self.logv = None
+        self.varE = None
 
     def resetparams(self, numfeatures=None):
         """Reset the parameters self.params to zero, clearing the
@@ -535,6 +553,9 @@ class BaseModel(six.with_metaclass(ABCMeta)):
         if hasattr(self, 'external'):
             self.external = None
 
+        # setparams() keeps the cache if the params were already zero
+        self.clearcache()
+
 
     def setcallback(self, callback=None, callback_dual=None, \
                     callback_grad=None):
@@ -1,14 +1,199 @@
+import os
 import types
 import math
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
+import scipy.sparse
 from scipy.special import logsumexp
+from scipy.linalg import norm
+from scipy.linalg.blas import dgemv, sgemv, dnrm2
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 from .basemodel import BaseModel
-from .utils import (innerprod, innerprodtranspose,
+from .utils import (innerprod, innerprodtranspose, logsumexp_softmax,
                     evaluate_feature_matrix, feature_sampler)
 
 
+# Target size in bytes of each block of the sample matrix when streaming
+# through it with BigModel.chunksize = 'auto'.  This should fit in the L2
+# cache.
+_CHUNK_BYTES = 2**18
+
+# The fewest columns per block with chunksize = 'auto', however many
+# features there are.  Narrower blocks cost more in per-block Python and
+# BLAS call overhead than they save in cache misses.
+_MIN_CHUNK_COLUMNS = 4096
+
+
+def _gemv(A, x, trans=0, out=None):
+    """Return A.dot(x) (or A.T.dot(x) if trans=1) for a dense 2d array A
+    using the BLAS gemv routine.
+
+    BLAS expects column-major storage, so a row-major A is passed as its
+    (column-major) transpose with the sense of `trans` flipped.  This
+    avoids an implicit copy of A on every call.
+
+    Single-precision matrices A use sgemv, which also rounds x to float32
+    and accumulates in single precision.  The result is always returned
+    as a float64 array.  If out is given (a contiguous float64 array of the
+    right length), the result is written into it.
+    """
+    if A.flags.f_contiguous:
+        trans_A = trans
+    else:
+        A = A.T
+        trans_A = 1 - trans
+    if A.dtype == np.float32:
+        y = sgemv(1.0, A, x, trans=trans_A)
+        if out is None:
+            return y.astype(np.float64)
+        out[:] = y
+        return out
+    elif out is None:
+        return dgemv(1.0, A, x, trans=trans_A)
+    else:
+        return dgemv(1.0, A, x, beta=0.0, y=out, trans=trans_A,
+                     overwrite_y=True)
+
+
+def _logv_const(logprobs, priorlogprobs=None):
+    """Return the array -log q(x_j) [+ log p_0(x_j)] of the terms of
+    log v_j that do not depend on the parameters.
+    """
+    logv_const = np.negative(logprobs, dtype=np.float64)
+    if priorlogprobs is not None:
+        logv_const += priorlogprobs
+    return logv_const
+
+
+def _estimate_fused(sampleF, params, logv_const, parallel=True):
+    """Estimate log Z and the feature expectations E_p f(X) in a single
+    pass over the (m x n) sample feature matrix sampleF.
+
+    This computes logv = theta.f(x_j) + logv_const, where logv_const is the
+    array -log q(x_j) [+ log p_0(x_j)] returned by _logv_const(), and then
+    overwrites it in place with the normalized importance weights w_j using
+    logsumexp_softmax().  It avoids the separate logsumexp pass and the
+    length-n temporaries that computing logv, logZ and exp(logv - logZ) one
+    after the other would require.
+
+    Pass parallel=False if calling this from several threads at once.  See
+    logsumexp_softmax().
+
+    Returns
+    -------
+    (logZ, mu) : the estimated log of the normalization term and the
+                 (length m) vector of estimated feature expectations.
+    """
+    n = sampleF.shape[1]
+    if scipy.sparse.issparse(sampleF):
+        logv = sampleF.T.dot(params)
+    else:
+        logv = _gemv(sampleF, params, trans=1)
+    logv += logv_const
+    # Reuse the buffer for the normalized weights w_j = v_j / sum_k v_k
+    w = logv
+    logZ = logsumexp_softmax(logv, w, parallel=parallel) - math.log(n)
+    if scipy.sparse.issparse(sampleF):
+        mu = sampleF.dot(w)
+    else:
+        mu = _gemv(sampleF, w, trans=0)
+    return logZ, mu
+
+
+def _estimate_chunked(sampleF, params, logv_const, chunksize):
+    """Estimate log Z and the feature expectations E_p f(X) like
+    _estimate_fused(), but streaming through the dense (m x n) matrix
+    sampleF in blocks of `chunksize` columns.
+
+    Each block's theta.f(x_j), log v, weights and contribution to F.dot(w)
+    are computed while the block is still in cache, so no length-n arrays
+    are needed.  The weights are kept relative to the largest log v seen so
+    far; when a later block has a larger maximum, the running sums are
+    rescaled by exp(old max - new max).  This needs only one pass over
+    sampleF.
+
+    Returns
+    -------
+    (logZ, mu) : as for _estimate_fused().
+    """
+    m, n = sampleF.shape
+    logvmax = -np.inf
+    denom = 0.0
+    mu = np.zeros(m)
+    for j0 in range(0, n, chunksize):
+        F_c = sampleF[:, j0:j0+chunksize]
+        logv_c = _gemv(F_c, params, trans=1)
+        logv_c += logv_const[j0:j0+chunksize]
+        chunkmax = logv_c.max()
+        if chunkmax == -np.inf:
+            # All weights in this block are zero
+            continue
+        if chunkmax > logvmax:
+            # Rescale the sums so far to the new maximum
+            scale = math.exp(logvmax - chunkmax)
+            denom *= scale
+            mu *= scale
+            logvmax = chunkmax
+        w_c = np.exp(np.subtract(logv_c, logvmax, out=logv_c), out=logv_c)
+        denom += w_c.sum()
+        mu += _gemv(F_c, w_c, trans=0)
+    if denom == 0.0:
+        # Every log v is -inf, so Z = 0 and the weights are undefined, as
+        # for logsumexp() and exp(logv - logZ)
+        mu.fill(np.nan)
+        return -np.inf, mu
+    mu /= denom
+    logZ = logvmax + math.log(denom) - math.log(n)
+    return logZ, mu
+
+
+def _sa_step(params, avgparams, y_k, a_k, k, ruppert, newparams):
+    """One stochastic approximation update of the parameters.
+
+    Sets newparams = params - a_k * y_k and, if ruppert is True, updates
+    the running (Ruppert-Polyak) average avgparams in place with newparams
+    as the k'th term.  Returns (newparams, avgparams).
+    """
+    np.subtract(params, a_k * y_k, out=newparams)
+    if ruppert:
+        avgparams *= (k - 1.0) / k
+        avgparams += newparams / k
+    return newparams, avgparams
+
+
+def _sign_switched(y_k, y_kminus1):
+    """Return True if the gradient estimates y_k and y_kminus1 point in
+    opposite directions (have a negative inner product).
+    """
+    return np.dot(y_k, y_kminus1) < 0
+
+
+if njit is not None:
+    # Compiled versions of the per-iteration arithmetic in stochapprox(),
+    # avoiding the temporaries and interpreter overhead of the above.
+    @njit
+    def _sa_step_numba(params, avgparams, y_k, a_k, k, ruppert, newparams):
+        for i in range(len(params)):
+            newparams[i] = params[i] - a_k * y_k[i]
+        if ruppert:
+            for i in range(len(params)):
+                avgparams[i] = ((k - 1.0) * avgparams[i] + newparams[i]) / k
+        return newparams, avgparams
+
+    @njit
+    def _sign_switched_numba(y_k, y_kminus1):
+        s = 0.0
+        for i in range(len(y_k)):
+            s += y_k[i] * y_kminus1[i]
+        return s < 0
+
+
 class BigModel(BaseModel):
     """
     A maximum-entropy or minimum-divergence (exponential-form) model on a
@@ -38,6 +223,10 @@ class BigModel(BaseModel):
         If your feature functions are not vectorized, you can wrap them in
         calls to np.vectorize(f_i), but beware the performance overhead.
 
+        Dense feature matrices are stored in column-major (Fortran) order
+        for efficient matrix-vector products.  Feature matrices returned in
+        another layout or dtype are copied once per sample.
+
     auxiliary_sampler : callable
 
         Pass auxiliary_sampler as a function that will be used for importance
@@ -50,6 +239,21 @@ class BigModel(BaseModel):
                       probability density (pdf or pmf) of each point under the
                       auxiliary sampling distribution.
 
+        If both the sampler and a function computing the whole feature
+        matrix are compiled with numba, set self.samplegen to a
+        JittedFeatureSampler to draw each sample in compiled code.
+
+    feature_dtype : np.float64 (default) or np.float32
+        The dtype used to store dense sample feature matrices.  With
+        np.float32 the matrix-vector products over the sample stream half
+        as many bytes, which roughly doubles their speed for large samples,
+        at the cost of single-precision arithmetic in both products: the
+        parameters are rounded to float32 and theta.f(x_j) is summed in
+        float32, as is F.dot(w) with the rounded weights w.  Only the
+        results are converted back to float64, in which log v, the log
+        normalization term, and the parameters themselves are kept.
+        Sparse feature matrices are unaffected.
+
 
     Algorithms
     ----------
@@ -76,20 +280,24 @@ class BigModel(BaseModel):
                  auxiliary_sampler,
                  *,
                  vectorized=True,
-                 format='csc_matrix'):
+                 format='csc_matrix',
+                 feature_dtype=np.float64):
         super(BigModel, self).__init__()
 
-        self.features = lambda xs: evaluate_feature_matrix(feature_functions,
-                                                           xs,
-                                                           vectorized=vectorized,
-                                                           format=format)
+        # The dtype of dense sample feature matrices (float64 or float32)
+        self.feature_dtype = feature_dtype
+
+        self.features = lambda xs, out=None: evaluate_feature_matrix(feature_functions,
+                                                                     xs,
+                                                                     vectorized=vectorized,
+                                                                     format=format,
+                                                                     out=out)
 
-        # We allow auxiliary_sampler to be a callable or a generator
-        # .__next__ method of a generator (which, curiously, isn't of MethodType).
-        assert (isinstance(auxiliary_sampler, (types.FunctionType,
-                                               types.MethodType,
-                                               types.GeneratorType))
-                or (hasattr(auxiliary_sampler, '__name__') and auxiliary_sampler.__name__ == '__next__'))
+        # We allow auxiliary_sampler to be a callable (including a function
+        # compiled with numba, or the .__next__ method of a generator) or a
+        # generator
+        assert (isinstance(auxiliary_sampler, types.GeneratorType)
+                or callable(auxiliary_sampler))
 
         if isinstance(auxiliary_sampler, types.GeneratorType):
             self.auxiliary_sampler = auxiliary_sampler.__next__
@@ -98,9 +306,45 @@ class BigModel(BaseModel):
 
         self.samplegen = feature_sampler(self.features, self.auxiliary_sampler)
 
+        # A generator like self.samplegen that writes each new sample into
+        # the existing dense arrays self.sampleF and self.samplelogprobs.
+        # See resample().
+        self._default_samplegen = self.samplegen
+        self._samplegen_inplace = None
+
+        # Normalized importance weights for the current sample and params.
+        # See _ensure_weights().
+        self._w = None
+
+        # Work arrays of length n for theta.f(x_j), log v and the weights w
+        # for the internal sample, allocated in resample() and reused for
+        # each evaluation.  The cached values self.logv and self._w are
+        # views of these, so they are overwritten after clearcache().
+        self._buf_dotF = None
+        self._buf_logv = None
+        self._buf_w = None
+
+        # Cache of theta.f(x_j) for the internal sample, and the params it
+        # was computed for.  See _paramsdotF().
+        self._paramsdotF_cache = None
+        self._last_params = None
+
         # Number of sample matrices to generate and use to estimate E and logZ
         self.matrixtrials = 1
 
+        # If not None, estimate logZ and E for a dense sample matrix by
+        # streaming through it in blocks of this many columns, so the
+        # working set stays in cache for very large samples.  Set this to
+        # 'auto' to choose blocks of about _CHUNK_BYTES, but at least
+        # _MIN_CHUNK_COLUMNS wide.
+        self.chunksize = None
+
+        # The stacked sample matrices used if matrixtrials > 1.  See
+        # resample_multi().
+        self.bigF = None
+        self.biglogprobs = None
+        self._bigF_trials = 0
+
         # Store the lowest dual estimate observed so far in the fitting process
         self.bestdual = float('inf')
 
@@ -145,10 +389,10 @@ class BigModel(BaseModel):
         self.staticsample = True
         # If matrixtrials > 1 and staticsample = True, (which is useful for
         # estimating variance between the different feature estimates),
-        # next(self.samplerFgen) will be called once for each trial
-        # (0,...,matrixtrials) for each iteration.  This allows using a set
-        # of feature matrices, each of which stays constant over all
-        # iterations.
+        # next(self.samplegen) will be called once for each trial
+        # (0,...,matrixtrials) by resample_multi() on the first iteration.
+        # This allows using a set of feature matrices, each of which stays
+        # constant over all iterations.
 
         self.resample()
 
@@ -206,29 +450,61 @@ class BigModel(BaseModel):
         """
         super(BigModel, self).fit(K)
 
+    def clearcache(self):
+        """Clears the interim results of computations depending on the
+        parameters and the sample.
+        """
+        super(BigModel, self).clearcache()
+        self._w = None
+
     def resample(self):
         """
         (Re)sample the matrix F of sample features, sample log probs, and
         (optionally) sample points too.
+
+        Dense sample arrays of an unchanged size are overwritten in place,
+        so any references to the previous self.sampleF or
+        self.samplelogprobs will see the new sample.
         """
 
         if self.verbose >= 3:
             print("(sampling)")
 
-        # First delete the existing sample matrix to save memory
-        # This matters, since these can be very large
-        if hasattr(self, 'sampleF'):
-            del self.sampleF
-        if hasattr(self, 'samplelogprobs'):
-            del self.samplelogprobs
-        if hasattr(self, 'sample'):
-            del self.sample
-
-        # Now generate a new sample
-        output = next(self.samplegen)
+        # Generate a new sample.  For dense features from the default
+        # generator, write it into the existing arrays rather than freeing
+        # and reallocating them, since these can be very large.
+        if (self._samplegen_inplace is not None
+                and self.samplegen is self._default_samplegen):
+            output = next(self._samplegen_inplace)
+        else:
+            output = next(self.samplegen)
 
         # Assume the format is (F, lp, sample)
-        (self.sampleF, self.samplelogprobs, self.sample) = output
+        (F, lp, self.sample) = output
+        reused = (hasattr(self, 'sampleF') and F is self.sampleF
+                  and lp is self.samplelogprobs)
+        if not reused:
+            self._samplegen_inplace = None
+            self.sampleF = F
+            self.samplelogprobs = lp
+
+        # Store dense feature matrices in column-major (Fortran) order, so
+        # that both theta.f(x_j) and F.dot(w) hit unit-stride BLAS gemv loops.
+        # This is a no-op if the feature function already returns a Fortran
+        # array of the right dtype.
+        if not scipy.sparse.issparse(self.sampleF):
+            self.sampleF = np.asfortranarray(self.sampleF,
+                                             dtype=self.feature_dtype)
+
+        # For sparse feature matrices, keep a CSC copy for computing
+        # theta.f(x_j) = F.T.dot(params) (a CSR product after transposing) and
+        # a CSR copy for F.dot(w), so neither product needs an implicit format
+        # conversion.  One of these is self.sampleF itself.
+        if scipy.sparse.issparse(self.sampleF):
+            self.sampleF_csr = self.sampleF.tocsr()
+            self.sampleF_csc = self.sampleF.tocsc()
+        else:
+            self.sampleF_csr = self.sampleF_csc = None
 
         # Check whether the number m of features and the dimensionalities are correct
         m, n = self.sampleF.shape
@@ -251,19 +527,171 @@ class BigModel(BaseModel):
         if self.verbose >= 3:
             print("(done)")
 
+        if (not reused and not scipy.sparse.issparse(self.sampleF)
+                and self.samplegen is self._default_samplegen):
+            # Keep our own copy of the log probs, since later samples will
+            # overwrite it
+            self.samplelogprobs = np.array(self.samplelogprobs, dtype=float)
+            self._samplegen_inplace = feature_sampler(self.features,
+                                                      self.auxiliary_sampler,
+                                                      out_F=self.sampleF,
+                                                      out_lp=self.samplelogprobs)
+
+        # (Re)allocate the work arrays if the sample size has changed
+        if self._buf_logv is None or len(self._buf_logv) != n:
+            self._buf_dotF = np.empty(n)
+            self._buf_logv = np.empty(n)
+            self._buf_w = np.empty(n)
+
+        # Precompute the terms of log v that don't depend on the params
+        self._logv_const = _logv_const(self.samplelogprobs,
+                                       self.priorlogprobs)
+        self._logv_const_prior = self.priorlogprobs
+
         # Now clear the temporary variables that are no longer correct for this
         # sample
+        self._paramsdotF_cache = None
         self.clearcache()
 
 
+    def resample_multi(self):
+        """
+        Sample self.matrixtrials feature matrices and store them side by
+        side as the column blocks of a single (m x T*n) matrix self.bigF,
+        with the corresponding log probs concatenated in self.biglogprobs.
+
+        estimate() uses these to compute the estimates for all T trials
+        with one matrix-vector product instead of one per trial.  If
+        self.staticsample is True, the same T sample matrices are used for
+        all iterations.
+        """
+        if self.verbose >= 3:
+            print("(sampling %d matrices)" % self.matrixtrials)
+
+        T = self.matrixtrials
+        Fs = []
+        logprobs = []
+        for trial in range(T):
+            (F, lp, sample) = next(self.samplegen)
+            if F.shape[0] != len(self.params):
+                raise ValueError("the sample feature generator returned"
+                                  " a feature matrix of incorrect dimensions."
+                                  " The number of rows must equal the number of model parameters.")
+            if Fs and F.shape != Fs[0].shape:
+                raise ValueError("the sample feature generator must return"
+                                 " samples of the same size for each trial")
+            if not (isinstance(lp, np.ndarray) and lp.shape == (F.shape[1],)):
+                raise ValueError('Your sampler appears to be spitting out logprobs of the wrong dimensionality.')
+            Fs.append(F)
+            logprobs.append(lp)
+
+        m, n = Fs[0].shape
+        if scipy.sparse.issparse(Fs[0]):
+            self.bigF = scipy.sparse.hstack(Fs, format='csc')
+        else:
+            # Allocate the stacked matrix only once if its shape is unchanged
+            if not (isinstance(self.bigF, np.ndarray)
+                    and self.bigF.shape == (m, T * n)
+                    and self.bigF.dtype == self.feature_dtype):
+                self.bigF = np.empty((m, T * n), dtype=self.feature_dtype,
+                                     order='F')
+            for trial, F in enumerate(Fs):
+                self.bigF[:, trial*n:(trial+1)*n] = F
+        self.biglogprobs = np.concatenate(logprobs)
+        if self.priorlogprobs is not None:
+            self._biglogv_const = _logv_const(self.biglogprobs,
+                                              np.tile(self.priorlogprobs, T))
+        else:
+            self._biglogv_const = _logv_const(self.biglogprobs)
+        self._bigF_trials = T
+
+        self.clearcache()
+
+    def _estimate_trials(self):
+        """Estimate log Z and the feature expectations separately for each
+        of the T sample matrices stored in self.bigF by resample_multi().
+
+        Returns
+        -------
+        (logZs, mus) : a length T array of estimates of log Z and a (T x m)
+                       array of estimates of the feature expectations.
+        """
+        T = self._bigF_trials
+        m, Tn = self.bigF.shape
+        n = Tn // T
+
+        # Row t of logv holds log v_j for sample matrix t
+        logv = self._matvec_transpose(self.bigF, self.params)
+        logv += self._biglogv_const
+        logv = logv.reshape(T, n)
+        lse = logsumexp(logv, axis=1)
+        logZs = lse - math.log(n)
+
+        # Normalized importance weights for each sample matrix
+        w = np.exp(np.subtract(logv, lse[:, np.newaxis], out=logv), out=logv)
+
+        if scipy.sparse.issparse(self.bigF):
+            # Multiply by the (T*n x T) block-diagonal matrix of weights
+            W = scipy.sparse.csc_matrix((w.ravel(),
+                                         (np.arange(Tn), np.repeat(np.arange(T), n))),
+                                        shape=(Tn, T))
+            mus = self.bigF.dot(W).toarray().T
+        else:
+            # View the Fortran-ordered bigF as a stack of T (m x n) blocks
+            F3 = self.bigF.reshape((m, n, T), order='F').transpose(2, 0, 1)
+            w = w.astype(self.bigF.dtype, copy=False)
+            mus = np.matmul(F3, w[:, :, np.newaxis])[:, :, 0]
+            mus = mus.astype(np.float64, copy=False)
+        return logZs, mus
+
     def log_norm_constant(self):
         """Estimate the normalization constant (partition function) using
         the current sample matrix F.
         """
         # First see whether logZ has been precomputed
-        if hasattr(self, 'logZapprox'):
+        if self.logZapprox is not None:
             return self.logZapprox
 
+        if self.external is None and (self.matrixtrials > 1
+                                      or self._chunksize() is not None):
+            # Estimate logZ together with the expectations, averaging over
+            # all the sample matrices or streaming through the sample matrix
+            self.estimate()
+        else:
+            self._ensure_weights()
+        return self.logZapprox
+
+    def _chunksize(self):
+        """Return the number of columns per block for streaming through
+        the internal sample matrix in estimate(), or None to process it all
+        at once.  Only dense sample matrices are processed in blocks.
+        """
+        if self.chunksize is None or self.external is not None \
+                or scipy.sparse.issparse(self.sampleF):
+            return None
+        if self.chunksize == 'auto':
+            m = self.sampleF.shape[0]
+            return max(_MIN_CHUNK_COLUMNS,
+                       _CHUNK_BYTES // (m * self.sampleF.itemsize))
+        if self.chunksize <= 0:
+            raise ValueError("chunksize must be None, 'auto' or a positive"
+                             " integer")
+        return self.chunksize
+
+    def _ensure_weights(self):
+        """Compute the normalized importance weights
+
+            w_j = v_j / sum_k v_k
+
+        for the current sample together with the estimate logZapprox of log
+        Z, using a single call to the logsumexp_softmax() kernel.  Both are
+        cached (as self._w and self.logZapprox) until clearcache() is called,
+        so whichever of log_norm_constant() and estimate() is called first
+        does the work for both.
+        """
+        if self._w is not None:
+            return
+
         # Compute log v = log [p_dot(s_j)/aux_dist(s_j)]   for
         # j=1,...,n=|sample| using a precomputed matrix of sample
         # features.
@@ -271,9 +699,12 @@ class BigModel(BaseModel):
 
         # Good, we have our logv.  Now:
         n = len(logv)
-        self.logZapprox = logsumexp(logv) - math.log(n)
-        return self.logZapprox
-
+        if self.external is None:
+            w = self._buf_w
+        else:
+            w = np.empty_like(logv)
+        self.logZapprox = logsumexp_softmax(logv, w) - math.log(n)
+        self._w = w
 
     def expectations(self):
         """
@@ -286,7 +717,7 @@ class BigModel(BaseModel):
         the generator function samplegen().
         """
         # See if already computed
-        if hasattr(self, 'mu'):
+        if self.mu is not None:
             return self.mu
         self.estimate()
         return self.mu
@@ -310,32 +741,99 @@ class BigModel(BaseModel):
                unnormalized pdf value of the point x_j under the current model.
         """
         # First see whether logv has been precomputed
-        if hasattr(self, 'logv'):
+        if self.logv is not None:
             return self.logv
 
         # Compute log v = log [p_dot(s_j)/aux_dist(s_j)]   for
         # j=1,...,n=|sample| using a precomputed matrix of sample
         # features.
         if self.external is None:
-            paramsdotF = innerprodtranspose(self.sampleF, self.params)
-            logv = paramsdotF - self.samplelogprobs
-            # Are we minimizing KL divergence between the model and a prior
-            # density p_0?
-            if self.priorlogprobs is not None:
-                logv += self.priorlogprobs
+            # (paramsdotF is cached here, so we don't modify it in place)
+            paramsdotF = self._paramsdotF(self.sampleF)
+            logv = np.add(paramsdotF, self._sample_logv_const(),
+                          out=self._buf_logv)
         else:
             e = self.external
-            paramsdotF = innerprodtranspose(self.externalFs[e], self.params)
-            logv = paramsdotF - self.external_logprobs[e]
-            # Are we minimizing KL divergence between the model and a prior
-            # density p_0?
-            if self.external_priorlogprobs is not None:
-                logv += self.external_priorlogprobs[e]
+            paramsdotF = self._paramsdotF(self.externalFs[e])
+            logv = np.add(paramsdotF, self._external_logv_consts[e],
+                          out=paramsdotF)
 
         # Good, we have our logv.  Now:
         self.logv = logv
         return logv
 
+    def _sample_logv_const(self):
+        """Return the array -log q(x_j) [+ log p_0(x_j)] of the terms of
+        log v_j that do not depend on the params for the internal sample.
+        This is precomputed in resample() and recomputed only if
+        self.priorlogprobs has been replaced since then.
+        """
+        if self._logv_const_prior is not self.priorlogprobs:
+            self._logv_const = _logv_const(self.samplelogprobs,
+                                           self.priorlogprobs)
+            self._logv_const_prior = self.priorlogprobs
+        return self._logv_const
+
+    def _paramsdotF(self, F):
+        """Return the array theta.f(x_j) of inner products of the
+        parameters with each column of the (m x n) feature matrix F.
+
+        Dense matrices are passed straight to the BLAS gemv routine, avoiding
+        the generic dispatch in innerprodtranspose() on this hot path.
+
+        For the internal sample matrix self.sampleF the result is cached
+        together with the parameters it was computed for.  If fewer than
+        m/10 parameters have changed since then (as when stochastic
+        approximation or a line search moves only a few coordinates), the
+        cached array is updated incrementally using only the corresponding
+        rows of F.  The returned array must not be modified.
+        """
+        if F is not self.sampleF:
+            return self._matvec_transpose(F, self.params)
+        if self.sampleF_csc is not None:
+            # Use the sparse format suited to each access pattern
+            F, F_rows = self.sampleF_csc, self.sampleF_csr
+        else:
+            F_rows = F
+
+        if (self._paramsdotF_cache is not None
+                and self._last_params.shape == self.params.shape):
+            delta = self.params - self._last_params
+            idx = np.flatnonzero(delta)
+            if len(idx) < len(self.params) / 10:
+                if len(idx) > 0:
+                    self._paramsdotF_cache += F_rows[idx].T.dot(delta[idx])
+                    self._last_params = self.params.copy()
+                return self._paramsdotF_cache
+
+        self._paramsdotF_cache = self._matvec_transpose(F, self.params,
+                                                        out=self._buf_dotF)
+        self._last_params = self.params.copy()
+        return self._paramsdotF_cache
+
+    @staticmethod
+    def _matvec(F, v):
+        """Return F.dot(v), using BLAS gemv directly for dense F.  This is
+        fastest for sparse F in CSR format.
+        """
+        if scipy.sparse.issparse(F):
+            return F.dot(v)
+        else:
+            return _gemv(F, v, trans=0)
+
+    @staticmethod
+    def _matvec_transpose(F, v, out=None):
+        """Return F.T.dot(v), using BLAS gemv directly for dense F.  This is
+        fastest for sparse F in CSC format.
+
+        For dense F, the result is written into the array out if given.
+        """
+        if scipy.sparse.issparse(F):
+            # Not innerprodtranspose(), which copies F in A.conj()
+            return F.T.dot(v)
+        else:
+            return _gemv(F, v, trans=1, out=out)
+
     def estimate(self):
         """
         Approximate both the feature expectation vector E_p f(X) and the log
@@ -359,7 +857,8 @@ class BigModel(BaseModel):
         more updating overhead but potentially stopping earlier (needing
         fewer samples).  In the matrix case, the features F={f_i(s_j)}
         and vector [log_aux_dist(s_j)] of log probabilities are generated
-        by calling resample().
+        by calling resample(), or by resample_multi() if self.matrixtrials
+        is > 1.
 
         We use [Rosenfeld01Wholesentence]'s estimate of E_p[f_i] as:
             {sum_j  p(s_j)/aux_dist(s_j) f_i(s_j) }
@@ -391,33 +890,39 @@ class BigModel(BaseModel):
 
         # Hereafter is the matrix code
 
-        mus = []
-        logZs = []
-
-        for trial in range(self.matrixtrials):
-            if self.verbose >= 2 and self.matrixtrials > 1:
-                print("(trial " + str(trial) + " ...)")
-
+        if self.external is None and self.matrixtrials > 1:
+            # Estimate with all the sample matrices at once
+            if (not self.staticsample) or self.bigF is None \
+                    or self._bigF_trials != self.matrixtrials:
+                self.resample_multi()
+            logZs, mus = self._estimate_trials()
+        else:
             # Resample if necessary
-            if (not self.staticsample) or self.matrixtrials > 1:
+            if self.external is None and not self.staticsample:
                 self.resample()
 
-            logv = self._logv()
-            n = len(logv)
-            logZ = self.log_norm_constant()
-            logZs.append(logZ)
-
-            # We don't need to handle negative values separately,
-            # because we don't need to take the log of the feature
-            # matrix sampleF. See Ed Schofield's PhD thesis, Section 4.4
-
-            logu = logv - logZ
-            if self.external is None:
-                averages =  self.sampleF.dot(np.exp(logu))
+            chunksize = self._chunksize()
+            if chunksize is not None:
+                logZ, averages = _estimate_chunked(self.sampleF, self.params,
+                                                   self._sample_logv_const(),
+                                                   chunksize)
             else:
-                averages = self.externalFs[self.external].dot(np.exp(logu))
-            averages /= n
-            mus.append(averages)
+                self._ensure_weights()
+
+                # We don't need to handle negative values separately,
+                # because we don't need to take the log of the feature
+                # matrix sampleF. See Ed Schofield's PhD thesis, Section 4.4
+                if self.external is None:
+                    if self.sampleF_csr is not None:
+                        F = self.sampleF_csr
+                    else:
+                        F = self.sampleF
+                else:
+                    F = self.externalFs[self.external]
+                logZ = self.logZapprox
+                averages = self._matvec(F, self._w)
+            logZs = [logZ]
+            mus = [averages]
 
         # Now we have T=trials vectors of the sample means.  If trials > 1,
         # estimate st dev of means and confidence intervals
@@ -425,19 +930,17 @@ class BigModel(BaseModel):
         if ttrials == 1:
             self.mu = mus[0]
             self.logZapprox = logZs[0]
-            try:
-                del self.varE       # make explicit that this has no meaning
-            except AttributeError:
-                pass
+            self.varE = None    # make explicit that this has no meaning
         else:
             # The log of the variance of logZ is:
             #     -log(n-1) + logsumexp(2*log|Z_k - meanZ|)
 
+            logZs = np.asarray(logZs)
             self.logZapprox = logsumexp(logZs) - math.log(ttrials)
-            stdevlogZ = np.array(logZs).std()
-            mus = np.array(mus)
-            self.varE = columnvariances(mus)
-            self.mu = columnmeans(mus)
+            stdevlogZ = logZs.std(ddof=1)
+            mus = np.vstack(mus)
+            self.varE = mus.var(axis=0, ddof=1)
+            self.mu = mus.mean(axis=0)
 
     def pdf(self, fx):
         """Returns the estimated density p_theta(x) at the point x with
@@ -517,7 +1020,18 @@ class BigModel(BaseModel):
         except AttributeError:
             raise AttributeError("first define the initial step size a_0")
 
-        avgparams = self.params
+        K = np.asarray(K, float)
+
+        if njit is not None:
+            sa_step, sign_switched = _sa_step_numba, _sign_switched_numba
+        else:
+            sa_step, sign_switched = _sa_step, _sign_switched
+
+        # Preallocate the buffers for the parameters and gradient estimates
+        avgparams = self.params.copy()
+        newparams = np.empty_like(avgparams)
+        y_k = np.zeros_like(avgparams)
+        y_kminus1 = np.zeros_like(avgparams)
         if self.exacttest:
             # store exact error each testconvergefreq iterations
             self.SAerror = []
@@ -534,7 +1048,7 @@ class BigModel(BaseModel):
                     # changes of sign of the gradient.  (If frequent swaps, the
                     # stepsize is too large.)
                     #n += (np.dot(y_k, y_kminus1) < 0)   # an indicator fn
-                    if np.dot(y_k, y_kminus1) < 0:
+                    if sign_switched(y_k, y_kminus1):
                         n += 1
                     else:
                         # Store iterations of sign switches (for plotting
@@ -565,6 +1079,10 @@ class BigModel(BaseModel):
             if self.verbose:
                 print("  step size is: " + str(a_k))
 
+            # Store the previous gradient estimate for the Deylon
+            # acceleration, reusing its buffer for the new one
+            y_k, y_kminus1 = y_kminus1, y_k
+
             self.matrixtrials = 1
             self.staticsample = False
             if self.andradottir:    # use Andradottir (1996)'s scaling?
@@ -572,19 +1090,17 @@ class BigModel(BaseModel):
                 y_k_1 = self.mu - K
                 self.estimate()   # resample and reestimate
                 y_k_2 = self.mu - K
-                y_k = y_k_1 / max(1.0, norm(y_k_2)) + \
-                      y_k_2 / max(1.0, norm(y_k_1))
+                norm_y_k_1 = dnrm2(y_k_1)
+                norm_y_k_2 = dnrm2(y_k_2)
+                np.add(y_k_1 / max(1.0, norm_y_k_2),
+                       y_k_2 / max(1.0, norm_y_k_1), out=y_k)
             else:
                 # Standard Robbins-Monro estimator
                 if not self.staticsample:
                     self.estimate()   # resample and reestimate
-                try:
-                    y_kminus1 = y_k    # store this for the Deylon acceleration
-                except NameError:
-                    pass               # if we're on iteration k=1, ignore this
-                y_k = self.mu - K
-            norm_y_k = norm(y_k)
+                np.subtract(self.mu, K, out=y_k)
             if self.verbose:
+                norm_y_k = dnrm2(y_k)
                 print("SA: after iteration " + str(k))
                 print("  approx dual fn is: " + str(self.logZapprox \
                             - np.dot(self.params, K)))
@@ -592,17 +1108,17 @@ class BigModel(BaseModel):
 
             # Update params (after the convergence tests too ... don't waste the
             # computation.)
+            sa_step(self.params, avgparams, y_k, a_k, k,
+                    self.ruppertaverage, newparams)
             if self.ruppertaverage:
                 # Use a simple average of all estimates so far, which
                 # Ruppert and Polyak show can converge more rapidly
-                newparams = self.params - a_k*y_k
-                avgparams = (k-1.0)/k*avgparams + 1.0/k * newparams
                 if self.verbose:
                     print("  new params[0:5] are: " + str(avgparams[0:5]))
                 self.setparams(avgparams)
             else:
                 # Use the standard Robbins-Monro estimator
-                self.setparams(self.params - a_k*y_k)
+                self.setparams(newparams)
 
             if k >= self.maxiter:
                 print("Reached maximum # iterations during stochastic" \
@@ -633,10 +1149,22 @@ class BigModel(BaseModel):
         assert len(F_list) == len(logprob_list)
 
         self.testevery = testevery
-        self.externalFs = F_list
+        self.externalFs = [F if scipy.sparse.issparse(F)
+                           else np.asfortranarray(F, dtype=self.feature_dtype)
+                           for F in F_list]
         self.external_logprobs = logprob_list
         self.external_priorlogprobs = priorlogprob_list
 
+        # Precompute the terms of log v that don't depend on the params
+        if priorlogprob_list is None:
+            self._external_logv_consts = [_logv_const(lp)
+                                          for lp in logprob_list]
+        else:
+            self._external_logv_consts = [_logv_const(lp, prior_lp)
+                                          for lp, prior_lp
+                                          in zip(logprob_list,
+                                                 priorlogprob_list)]
+
         # Store the dual and mean square error based on the internal and
         # external (test) samples.  (The internal sample is used
         # statically for sample path optimization; the test samples are
@@ -664,20 +1192,19 @@ class BigModel(BaseModel):
             print("Now testing model on external sample(s) ...")
 
         # Estimate the entropy dual and gradient for each sample.  These
-        # are not regularized (smoothed).
-        dualapprox = []
-        gradnorms = []
-        for e in range(len(self.externalFs)):
-            self.external = e
-            self.clearcache()
-            if self.verbose >= 2:
-                print("(testing with sample %d)" % e)
-            dualapprox.append(self.dual(ignorepenalty=True, ignoretest=True))
-            gradnorms.append(norm(self.grad(ignorepenalty=True)))
-
-        # Reset to using the normal sample matrix sampleF
-        self.external = None
-        self.clearcache()
+        # are not regularized (smoothed).  The samples are independent and
+        # the BLAS routines release the GIL, so test them in parallel.
+        numsamples = len(self.externalFs)
+        if numsamples <= 1:
+            results = [self._test_one(e, parallel=True)
+                       for e in range(numsamples)]
+        else:
+            max_workers = min(numsamples, os.cpu_count() or 1)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(self._test_one,
+                                            range(numsamples)))
+        dualapprox = [dual for (dual, gradnorm) in results]
+        gradnorms = [gradnorm for (dual, gradnorm) in results]
 
         meandual = np.average(dualapprox,axis=0)
         self.external_duals[self.iters] = dualapprox
@@ -697,3 +1224,27 @@ class BigModel(BaseModel):
             self.bestparams = self.params
             if self.verbose:
                 print("\n\t\t\tStored new minimum entropy dual: %f\n" % meandual)
+
+    def _test_one(self, e, parallel=False):
+        """Estimate the (unregularized) entropy dual and the norm of its
+        gradient on the external sample e.
+
+        Unlike calling dual() and grad() with self.external = e, this
+        doesn't modify the model, so it can run on several external
+        samples in parallel threads.  Pass parallel=True only when calling
+        it from a single thread (see logsumexp_softmax()).
+
+        Returns
+        -------
+        (dual, gradnorm)
+        """
+        if self.verbose >= 2:
+            print("(testing with sample %d)" % e)
+        logZ, mu = _estimate_fused(self.externalFs[e], self.params,
+                                   self._external_logv_consts[e],
+                                   parallel=parallel)
+        dual = logZ - np.dot(self.params, self.K)
+        if np.isnan(dual):
+            raise ValueError('Oops: the dual is nan! Debug me!')
+        gradnorm = norm(mu - self.K)
+        return (dual, gradnorm)
@@ -134,7 +134,7 @@ class ConditionalModel(Model):
         with one element for each context w.
         """
         # See if it's been precomputed
-        if hasattr(self, 'logZ'):
+        if self.logZ is not None:
             return self.logZ
 
         numcontexts = self.numcontexts
@@ -285,7 +285,7 @@ class ConditionalModel(Model):
         # Do we have a prior distribution p_0?
         if self.priorlogprobs is not None:
             log_p_dot += self.priorlogprobs
-        if not hasattr(self, 'logZ'):
+        if self.logZ is None:
             # Compute the norm constant (quickly!)
             self.logZ = np.zeros(numcontexts, float)
             for w in range(numcontexts):
@@ -158,7 +158,7 @@ class Model(BaseModel):
         The sample space must be discrete and finite.
         """
         # See if it's been precomputed
-        if hasattr(self, 'logZ'):
+        if self.logZ is not None:
             return self.logZ
 
         # Has F = {f_i(x_j)} been precomputed?
@@ -210,7 +210,7 @@ class Model(BaseModel):
         # Do we have a prior distribution p_0?
         if self.priorlogprobs is not None:
             log_p_dot += self.priorlogprobs
-        if not hasattr(self, 'logZ'):
+        if self.logZ is None:
             # Compute the norm constant (quickly!)
             self.logZ = logsumexp(log_p_dot)
         return log_p_dot - self.logZ
@@ -244,7 +244,7 @@ class Model(BaseModel):
         as self.samplespace as a list or array.
         """
 
-        if hasattr(self, 'logZ'):
+        if self.logZ is not None:
             logZ = self.logZ
         else:
             logZ = self.log_partition_function()
@@ -28,20 +28,29 @@ import numpy as np
 #from numpy import log, exp, asarray, ndarray, empty
 import scipy.sparse
 from scipy.special import logsumexp
+from scipy.linalg.blas import dgemv
+
+try:
+    from numba import njit, prange
+    from numba.extending import is_jitted
+except ImportError:
+    njit = None
 
 
 __all__ = ['feature_sampler',
+           'JittedFeatureSampler',
            'dictsample',
            'dictsampler',
            'auxiliary_sampler_scipy',
            'evaluate_feature_matrix',
            'innerprod',
            'innerprodtranspose',
+           'logsumexp_softmax',
            'DivergenceError']
 
 
 
-def feature_sampler(vec_f, auxiliary_sampler):
+def feature_sampler(vec_f, auxiliary_sampler, out_F=None, out_lp=None):
     """
     A generator function for tuples (F, log_q_xs, xs)
 
@@ -60,6 +69,16 @@ def feature_sampler(vec_f, auxiliary_sampler):
         xs : list, 1d ndarray, or 2d matrix (n x d)
             We require len(xs) == n.
 
+    out_F : None or (m x n) ndarray
+        If given, `vec_f` is called as vec_f(xs, out=out_F) to fill in this
+        array instead of allocating a new one for each sample.
+
+    out_lp : None or 1d ndarray of length n
+        If given, the log probs log_q_xs are copied into this array.
+
+        Each yielded sample then overwrites the previous one.  The buffers
+        are ignored for samples whose size n doesn't match.
+
 
     Yields
     ------
@@ -72,10 +91,71 @@ def feature_sampler(vec_f, auxiliary_sampler):
     """
     while True:
         xs, log_q_xs = auxiliary_sampler()
-        F = vec_f(xs)  # compute feature matrix from points
+        # compute feature matrix from points
+        if out_F is not None and out_F.shape[1] == len(xs):
+            F = vec_f(xs, out=out_F)
+        else:
+            F = vec_f(xs)
+        if out_lp is not None and np.shape(log_q_xs) == out_lp.shape:
+            np.copyto(out_lp, log_q_xs)
+            log_q_xs = out_lp
         yield F, log_q_xs, xs
 
 
+if njit is not None:
+    @njit
+    def _jitted_feature_sample(vec_f, auxiliary_sampler):
+        xs, log_q_xs = auxiliary_sampler()
+        return vec_f(xs), log_q_xs, xs
+
+
+class JittedFeatureSampler(object):
+    """
+    An iterator over tuples (F, log_q_xs, xs), like feature_sampler(), for
+    a feature function and auxiliary sampler compiled with numba.
+
+    Each call to next() runs one compiled function that draws the sample
+    and computes its feature matrix, rather than resuming a Python
+    generator that calls each of them in turn.
+
+    Parameters
+    ----------
+    vec_f : numba-compiled function
+        A function decorated with @numba.njit that operates on a vector of
+        samples xs = {x1,...,xn} and returns a feature matrix (m x n) as an
+        ndarray.
+
+    auxiliary_sampler : numba-compiled function
+        A function decorated with @numba.njit that takes no arguments and
+        returns a tuple (xs, log_q_xs) as for feature_sampler().
+
+    If numba is not installed, or either function is an ordinary Python
+    function, this just iterates over feature_sampler(vec_f,
+    auxiliary_sampler).
+
+    To use this with a BigModel, set it as the model's sample generator:
+
+        model.samplegen = JittedFeatureSampler(vec_f, auxiliary_sampler)
+        model.resample()
+    """
+    def __init__(self, vec_f, auxiliary_sampler):
+        self.vec_f = vec_f
+        self.auxiliary_sampler = auxiliary_sampler
+        self.jitted = (njit is not None and is_jitted(vec_f)
+                       and is_jitted(auxiliary_sampler))
+        if not self.jitted:
+            self._samplegen = feature_sampler(vec_f, auxiliary_sampler)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.jitted:
+            return _jitted_feature_sample(self.vec_f, self.auxiliary_sampler)
+        else:
+            return next(self._samplegen)
+
+
 def dictsample(freq, size=None, return_probs=None):
     """
     Create a sample of the given size from the specified discrete distribution.
@@ -240,6 +320,90 @@ def logsumexp_naive(values):
     return math.log(s)
 
 
+def _logsumexp_softmax(logv, w):
+    """Returns logsumexp(logv) and fills the array w with the softmax
+    weights exp(logv - logsumexp(logv)).  w may be the same array as logv.
+    """
+    logvmax = logv.max()
+    if logvmax == -np.inf:
+        # All weights are zero, so the normalized weights are undefined
+        w.fill(np.nan)
+        return -np.inf
+    np.subtract(logv, logvmax, out=w)
+    np.exp(w, out=w)
+    s = w.sum()
+    w /= s
+    return logvmax + math.log(s)
+
+
+if njit is not None:
+    def _logsumexp_softmax_kernel(logv, w):
+        logvmax = logv.max()
+        if logvmax == -math.inf:
+            w[:] = math.nan
+            return -math.inf
+        s = 0.0
+        for i in prange(len(logv)):
+            w[i] = math.exp(logv[i] - logvmax)
+            s += w[i]
+        for i in prange(len(logv)):
+            w[i] /= s
+        return logvmax + math.log(s)
+
+    # Allow reassociation (for vectorized, parallel sums) but not the
+    # 'no infs' assumption of fastmath=True: log v can legitimately be -inf
+    # where the prior density is zero.
+    _fastmath = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+    _logsumexp_softmax_numba = njit(parallel=True, fastmath=_fastmath)(
+        _logsumexp_softmax_kernel)
+    # prange is just range without parallel=True.  This version is safe to
+    # call from several Python threads at once, which numba's default
+    # (workqueue) threading layer is not for parallel kernels.
+    _logsumexp_softmax_numba_serial = njit(fastmath=_fastmath)(
+        _logsumexp_softmax_kernel)
+
+
+def logsumexp_softmax(logv, w, parallel=True):
+    """Computes logsumexp(logv) and the softmax weights exp(logv -
+    logsumexp(logv)) together, with fewer passes over the array than
+    calling logsumexp() and then np.exp().
+
+    Parameters
+    ----------
+    logv : 1d ndarray of floats
+
+    w : 1d ndarray of floats, of the same length as logv
+        The output array for the softmax weights.  This may be logv itself.
+
+    parallel : bool (default True)
+        Whether to run the compiled kernel on multiple threads.  Pass False
+        when calling this from several Python threads at once.
+
+    Returns
+    -------
+    logZ : float
+        logsumexp(logv)
+
+    If numba is installed, this uses a compiled kernel that runs in
+    parallel; otherwise it falls back to NumPy.
+
+    >>> logv = np.log(np.array([1., 2., 5.]))
+    >>> w = np.empty(3)
+    >>> round(float(np.exp(logsumexp_softmax(logv, w))), 6)
+    8.0
+    >>> w
+    array([0.125, 0.25 , 0.625])
+    """
+    if (njit is not None and logv.dtype == np.float64
+            and w.dtype == np.float64):
+        if parallel:
+            return _logsumexp_softmax_numba(logv, w)
+        else:
+            return _logsumexp_softmax_numba_serial(logv, w)
+    else:
+        return _logsumexp_softmax(logv, w)
+
+
 def robustlog(x):
     """Returns log(x) if x > 0, the complex log cmath.log(x) if x < 0,
     or float('-inf') if x == 0.
@@ -331,7 +495,8 @@ def evaluate_feature_matrix(feature_functions,
                             vectorized=True,
                             format='csc_matrix',
                             dtype=float,
-                            verbose=False):
+                            verbose=False,
+                            out=None):
     """Evaluate a (m x n) matrix of features `F` of the sample `xs` as:
 
         F[i, :] = f_i(xs[:])
@@ -363,6 +528,10 @@ def evaluate_feature_matrix(feature_functions,
         If you have enough memory, it may be faster to create a dense
         ndarray and then construct a e.g. CSC matrix from this.
 
+    out : None or (m x n) ndarray
+        If given (with format 'ndarray'), the features are written into
+        this array, which is returned, instead of into a new one.
+
     Returns
     -------
     F : (m x n) matrix (in the given format: ndarray / csc_matrix / etc.)
@@ -384,10 +553,17 @@ def evaluate_feature_matrix(feature_functions,
     else:
         n, d = len(xs), 1
 
-    if format in ('dok_matrix', 'csc_matrix', 'csr_matrix'):
+    if out is not None:
+        if format != 'ndarray':
+            raise ValueError("out is only supported with format 'ndarray'")
+        if out.shape != (m, n):
+            raise ValueError('out must have shape (m, n) = ' + str((m, n)))
+        F = out
+    elif format in ('dok_matrix', 'csc_matrix', 'csr_matrix'):
         F = scipy.sparse.dok_matrix((m, n), dtype=dtype)
     elif format == 'ndarray':
-        F = np.empty((m, n), dtype=dtype)
+        # Column-major, as expected by BigModel for BLAS matrix-vector products
+        F = np.empty((m, n), dtype=dtype, order='F')
     else:
         raise ValueError('matrix format not recognized')
 
@@ -686,6 +862,9 @@ def innerprodtranspose(A,v):
     A.T.dot(v) for dense arrays and spmatrix objects, and for
     A.matvec_transp(v, result) for pysparse matrices.
 
+    For a dense 2d float64 array A and a rank-1 float64 array v this calls
+    the BLAS gemv routine directly, without first making a row vector of v.
+
     """
 
     (m, n) = A.shape
@@ -705,7 +884,15 @@ def innerprodtranspose(A,v):
         # Assume A is dense
         if isinstance(v, np.ndarray):
             # v is also dense
-            if len(v.shape) == 1:
+            if (type(A) is np.ndarray and A.ndim == 2 and v.ndim == 1
+                    and A.dtype == np.float64 and v.dtype == np.float64):
+                # Call BLAS gemv directly.  BLAS expects column-major storage,
+                # so pass a row-major A as its transpose to avoid a copy.
+                if A.flags.f_contiguous:
+                    return dgemv(1.0, A, v, trans=1)
+                else:
+                    return dgemv(1.0, A.T, v, trans=0)
+            elif len(v.shape) == 1:
                 # We can't transpose a rank-1 matrix into a row vector, so
                 # we reshape it.
                 vm = v.shape[0]
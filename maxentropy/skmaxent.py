@@ -280,8 +280,8 @@ class MinDivergenceModel(BaseEstimator, DensityMixin, BaseModel):
         The sample space must be discrete and finite.
         """
         # See if it's been precomputed
-        if hasattr(self, 'logZ_'):
-            return self.logZ_
+        if self.logZ is not None:
+            return self.logZ
 
         # Has F = {f_i(x_j)} been precomputed?
         if not hasattr(self, 'F'):
@@ -330,7 +330,7 @@ class MinDivergenceModel(BaseEstimator, DensityMixin, BaseModel):
         # Do we have a prior distribution p_0?
         if self.priorlogprobs is not None:
             log_p_dot += self.priorlogprobs
-        if not hasattr(self, 'logZ'):
+        if self.logZ is None:
             # Compute the norm constant (quickly!)
             self.logZ = logsumexp(log_p_dot)
         return log_p_dot - self.logZ
@@ -653,7 +653,7 @@ class MCMinDivergenceModel(BaseEstimator, DensityMixin, BaseModel):
         the current sample matrix F.
         """
         # First see whether logZ has been precomputed
-        if hasattr(self, 'logZapprox'):
+        if self.logZapprox is not None:
             return self.logZapprox
 
         # Compute log v = log [p_dot(s_j)/aux_dist(s_j)]   for
@@ -677,7 +677,7 @@ class MCMinDivergenceModel(BaseEstimator, DensityMixin, BaseModel):
         the generator function samplegen().
         """
         # See if already computed
-        if hasattr(self, 'mu'):
+        if self.mu is not None:
             return self.mu
         self.estimate()
         return self.mu
@@ -701,7 +701,7 @@ class MCMinDivergenceModel(BaseEstimator, DensityMixin, BaseModel):
                unnormalized pdf value of the point x_j under the current model.
         """
         # First see whether logv has been precomputed
-        if hasattr(self, 'logv'):
+        if self.logv is not None:
             return self.logv
 
         # Compute log v = log [p_dot(s_j)/aux_dist(s_j)]   for
@@ -802,12 +802,16 @@ class MCMinDivergenceModel(BaseEstimator, DensityMixin, BaseModel):
             # because we don't need to take the log of the feature
             # matrix sample_F. See Ed Schofield's PhD thesis, Section 4.4
 
-            logu = logv - logZ
+            # The self-normalized importance weights v_j / sum_k v_k =
+            # exp(logv_j - log(n Z)), computed in one buffer from the logZ we
+            # already have.  These sum to 1, so the weighted sum needs no
+            # division by n.
+            w = np.subtract(logv, logZ + math.log(n))
+            np.exp(w, out=w)
             if self.external is None:
-                averages =  self.sample_F.dot(np.exp(logu))
+                averages = self.sample_F.dot(w)
             else:
-                averages = self.external_Fs[self.external].dot(np.exp(logu))
-            averages /= n
+                averages = self.external_Fs[self.external].dot(w)
             mus.append(averages)
 
         # Now we have T=trials vectors of the sample means.  If trials > 1,
@@ -816,19 +820,17 @@ class MCMinDivergenceModel(BaseEstimator, DensityMixin, BaseModel):
         if ttrials == 1:
             self.mu = mus[0]
             self.logZapprox = logZs[0]
-            try:
-                del self.varE       # make explicit that this has no meaning
-            except AttributeError:
-                pass
+            self.varE = None    # make explicit that this has no meaning
         else:
             # The log of the variance of logZ is:
             #     -log(n-1) + logsumexp(2*log|Z_k - meanZ|)
 
+            logZs = np.asarray(logZs)
             self.logZapprox = logsumexp(logZs) - math.log(ttrials)
-            stdevlogZ = np.array(logZs).std()
-            mus = np.array(mus)
-            self.varE = columnvariances(mus)
-            self.mu = columnmeans(mus)
+            stdevlogZ = logZs.std(ddof=1)
+            mus = np.vstack(mus)
+            self.varE = mus.var(axis=0, ddof=1)
+            self.mu = mus.mean(axis=0)
 
     def pdf(self, fx, *, log_prior_x=None):
         """Returns the estimated density p_theta(x) at the point x with
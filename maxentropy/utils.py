@@ -25,6 +25,7 @@ import numpy as np
 #from numpy import log, exp, asarray, ndarray, empty
 import scipy.sparse
 from scipy.special import logsumexp
+from scipy.linalg.blas import dgemv
 
 
 __all__ = ['feature_sampler',
@@ -683,6 +684,9 @@ def innerprodtranspose(A,v):
     A.T.dot(v) for dense arrays and spmatrix objects, and for
     A.matvec_transp(v, result) for pysparse matrices.
 
+    For a dense 2d float64 array A and a rank-1 float64 array v this calls
+    the BLAS gemv routine directly, without first making a row vector of v.
+
     """
 
     (m, n) = A.shape
@@ -702,7 +706,15 @@ def innerprodtranspose(A,v):
         # Assume A is dense
         if isinstance(v, np.ndarray):
             # v is also dense
-            if len(v.shape) == 1:
+            if (type(A) is np.ndarray and A.ndim == 2 and v.ndim == 1
+                    and A.dtype == np.float64 and v.dtype == np.float64):
+                # Call BLAS gemv directly.  BLAS expects column-major storage,
+                # so pass a row-major A as its transpose to avoid a copy.
+                if A.flags.f_contiguous:
+                    return dgemv(1.0, A, v, trans=1)
+                else:
+                    return dgemv(1.0, A.T, v, trans=0)
+            elif len(v.shape) == 1:
                 # We can't transpose a rank-1 matrix into a row vector, so
                 # we reshape it.
                 vm = v.shape[0]
@@ -0,0 +1,276 @@
+"""Tests for the Monte Carlo estimators of the (scipy-style) BigModel class.
+"""
+
+import numpy as np
+import pytest
+import scipy.sparse
+import scipy.stats
+from scipy.special import logsumexp
+
+import maxentropy
+from maxentropy.scipy.bigmodel import _estimate_fused, _estimate_chunked
+from maxentropy.scipy.utils import logsumexp_softmax, _logsumexp_softmax
+
+
+def f0(x):
+    return x
+
+def f1(x):
+    return x**2
+
+features = [f0, f1]
+
+target_expectations = [1.0, 2.0]
+
+K = np.atleast_2d(target_expectations)
+
+
+def make_sampler(n=10**4, seed=0):
+    auxiliary = scipy.stats.norm(loc=0.0, scale=2.0)
+    rng = np.random.RandomState(seed)
+    def sampler():
+        xs = auxiliary.rvs(size=n, random_state=rng)
+        return xs, auxiliary.logpdf(xs)
+    return sampler
+
+
+def naive_estimate(F, params, logprobs):
+    logv = F.T.dot(params) - logprobs
+    n = len(logv)
+    logZ = logsumexp(logv) - np.log(n)
+    mu = F.dot(np.exp(logv - logZ)) / n
+    return logZ, mu
+
+
+def test_estimate_fused():
+    rng = np.random.RandomState(1)
+    F = rng.normal(size=(3, 1000))
+    params = np.array([0.1, -0.2, 0.3])
+    logprobs = rng.normal(size=1000)
+    logZ0, mu0 = naive_estimate(F, params, logprobs)
+    for A in [F, np.asfortranarray(F), scipy.sparse.csc_matrix(F)]:
+        logZ, mu = _estimate_fused(A, params, -logprobs)
+        assert np.isclose(logZ, logZ0)
+        assert np.allclose(mu, mu0)
+
+
+def test_bigmodel_fit():
+    for fmt in ['ndarray', 'csc_matrix']:
+        model = maxentropy.BigModel(features, make_sampler(), format=fmt)
+        model.fit(K)
+        assert np.allclose(model.expectations(), target_expectations)
+        logZ, mu = naive_estimate(model.sampleF, model.params,
+                                  model.samplelogprobs)
+        assert np.isclose(model.log_norm_constant(), logZ)
+
+
+def test_bigmodel_float32_features():
+    model = maxentropy.BigModel(features, make_sampler(), format='ndarray',
+                                feature_dtype=np.float32)
+    assert model.sampleF.dtype == np.float32
+    model.fit(K)
+    assert model.expectations().dtype == np.float64
+    assert np.allclose(model.expectations(), target_expectations, atol=1e-3)
+
+
+def test_logsumexp_softmax():
+    rng = np.random.RandomState(2)
+    logv = rng.normal(scale=100.0, size=1000)
+    logv[0] = -np.inf
+    for lse_softmax in [logsumexp_softmax, _logsumexp_softmax]:
+        w = np.empty_like(logv)
+        logZ = lse_softmax(logv, w)
+        assert np.isclose(logZ, logsumexp(logv))
+        assert np.allclose(w, np.exp(logv - logsumexp(logv)))
+        assert np.isclose(w.sum(), 1.0)
+    # Zero prior density on the whole sample
+    logv = np.full(100, -np.inf)
+    serial = lambda logv, w: logsumexp_softmax(logv, w, parallel=False)
+    for lse_softmax in [logsumexp_softmax, serial, _logsumexp_softmax]:
+        w = np.empty_like(logv)
+        assert lse_softmax(logv, w) == -np.inf
+        assert np.all(np.isnan(w))
+
+
+def test_paramsdotF_incremental_update():
+    # With m = 20 features, changing one parameter updates the cached
+    # theta.f(x_j) incrementally
+    powers = [lambda x, i=i: x**i / 10.0**i for i in range(20)]
+    for fmt in ['ndarray', 'csc_matrix']:
+        model = maxentropy.BigModel(powers, make_sampler(n=1000), format=fmt)
+        F = model.sampleF
+        params = np.zeros(20)
+        model.setparams(params)
+        model._paramsdotF(F)
+        params[3] = 0.5
+        model.setparams(params)
+        paramsdotF = model._paramsdotF(F)
+        assert paramsdotF is model._paramsdotF_cache
+        assert np.allclose(paramsdotF, F.T.dot(params))
+
+
+def test_matrixtrials():
+    for fmt in ['ndarray', 'csc_matrix']:
+        model = maxentropy.BigModel(features, make_sampler(n=1000), format=fmt)
+        model.matrixtrials = 3
+        model.setparams([0.1, -0.1])
+        mu = model.expectations()
+        assert model.bigF.shape == (2, 3000)
+        logZs, mus = [], []
+        for t in range(3):
+            F = model.bigF[:, t*1000:(t+1)*1000]
+            logprobs = model.biglogprobs[t*1000:(t+1)*1000]
+            logZ, mu_t = naive_estimate(F, model.params, logprobs)
+            logZs.append(logZ)
+            mus.append(mu_t)
+        assert np.allclose(mu, np.mean(mus, axis=0))
+        assert np.isclose(model.log_norm_constant(),
+                          logsumexp(logZs) - np.log(3))
+        assert model.varE.shape == (2,)
+        # With staticsample = True the same matrices are reused
+        bigF = model.bigF
+        model.setparams([0.2, -0.1])
+        model.expectations()
+        assert model.bigF is bigF
+
+
+def test_chunked_estimate():
+    model = maxentropy.BigModel(features, make_sampler(n=1000),
+                                format='ndarray')
+    model.setparams([0.1, -0.1])
+    logZ, mu = naive_estimate(model.sampleF, model.params,
+                              model.samplelogprobs)
+    for chunksize in [1, 128, 1000, 5000, 'auto']:
+        model.chunksize = chunksize
+        model.clearcache()
+        assert np.isclose(model.log_norm_constant(), logZ)
+        assert np.allclose(model.expectations(), mu)
+
+
+def test_chunksize_auto():
+    powers = [lambda x, i=i: x**i / 10.0**i for i in range(20)]
+    model = maxentropy.BigModel(powers, make_sampler(n=1000),
+                                format='ndarray')
+    model.chunksize = 'auto'
+    # Blocks of 256 KiB would have only 1638 columns
+    assert model._chunksize() == 4096
+    model = maxentropy.BigModel(features, make_sampler(n=1000),
+                                format='ndarray')
+    model.chunksize = 'auto'
+    assert model._chunksize() == 16384
+    model.chunksize = 0
+    with pytest.raises(ValueError):
+        model.expectations()
+
+
+def test_chunked_estimate_zero_weights():
+    # log v = -inf everywhere, e.g. where the prior density is zero
+    F = np.ones((2, 100))
+    logZ, mu = _estimate_chunked(F, np.zeros(2), np.full(100, -np.inf), 16)
+    assert logZ == -np.inf
+    assert np.all(np.isnan(mu))
+
+
+def test_external_samples():
+    model = maxentropy.BigModel(features, make_sampler(n=1000),
+                                format='ndarray')
+    model.setparams([0.1, -0.1])
+    model.K = K[0]
+    sampler = make_sampler(n=1000, seed=3)
+    Fs, logprobs = [], []
+    for i in range(3):
+        xs, lp = sampler()
+        Fs.append(np.array([f0(xs), f1(xs)]))
+        logprobs.append(lp)
+    model.settestsamples(Fs, logprobs)
+    model.test()
+    duals = model.external_duals[model.iters]
+    gradnorms = model.external_gradnorms[model.iters]
+    for e in range(3):
+        logZ, mu = naive_estimate(Fs[e], model.params, logprobs[e])
+        assert np.isclose(duals[e], logZ - np.dot(model.params, model.K))
+        assert np.isclose(gradnorms[e], np.linalg.norm(mu - model.K))
+    assert model.external is None
+
+    # One or no external samples are tested without a thread pool
+    model.settestsamples(Fs[:1], logprobs[:1])
+    model.test()
+    assert np.isclose(model.external_duals[model.iters][0], duals[0])
+    model.settestsamples([], [])
+    model.test()
+    assert model.external_duals[model.iters] == []
+
+
+def test_resample_in_place():
+    model = maxentropy.BigModel(features, make_sampler(n=1000),
+                                format='ndarray')
+    F, logprobs = model.sampleF, model.samplelogprobs
+    model.resample()
+    assert model.sampleF is F and model.samplelogprobs is logprobs
+    xs = model.sample
+    assert np.allclose(model.sampleF, [f0(xs), f1(xs)])
+    assert np.allclose(model.samplelogprobs,
+                       scipy.stats.norm(loc=0.0, scale=2.0).logpdf(xs))
+
+
+def test_jitted_feature_sampler():
+    from maxentropy.scipy.utils import JittedFeatureSampler
+    try:
+        from numba import njit
+    except ImportError:
+        njit = lambda f: f
+
+    @njit
+    def vec_f(xs):
+        F = np.empty((2, len(xs)))
+        F[0] = xs
+        F[1] = xs**2
+        return F
+
+    @njit
+    def sampler():
+        xs = 2.0 * np.random.standard_normal(1000)
+        return xs, -0.5 * (xs / 2.0)**2 - np.log(2.0 * np.sqrt(2 * np.pi))
+
+    model = maxentropy.BigModel(features, make_sampler(n=1000),
+                                format='ndarray')
+    model.samplegen = JittedFeatureSampler(vec_f, sampler)
+    model.resample()
+    xs = model.sample
+    assert np.allclose(model.sampleF, [f0(xs), f1(xs)])
+    assert np.allclose(model.samplelogprobs,
+                       scipy.stats.norm(loc=0.0, scale=2.0).logpdf(xs))
+
+
+def test_setparams_keeps_cache_if_unchanged():
+    model = maxentropy.BigModel(features, make_sampler(n=1000),
+                                format='ndarray')
+    model.setparams([0.1, -0.1])
+    mu = model.expectations()
+    model.setparams(np.array([0.1, -0.1]))
+    assert model.mu is mu
+    model.setparams([0.2, -0.1])
+    assert model.mu is None
+    # Modifying self.params in place still clears the cache
+    model.expectations()
+    model.params[0] = 0.3
+    model.setparams(model.params)
+    assert model.mu is None
+
+
+def test_sa_step_numba():
+    from maxentropy.scipy import bigmodel
+    if bigmodel.njit is None:
+        return
+    rng = np.random.RandomState(4)
+    params, avgparams, y_k, y_kminus1 = rng.normal(size=(4, 5))
+    for ruppert in [False, True]:
+        new0, avg0 = np.empty(5), avgparams.copy()
+        bigmodel._sa_step(params, avg0, y_k, 0.1, 3, ruppert, new0)
+        new1, avg1 = np.empty(5), avgparams.copy()
+        bigmodel._sa_step_numba(params, avg1, y_k, 0.1, 3, ruppert, new1)
+        assert np.allclose(new0, new1)
+        assert np.allclose(avg0, avg1)
+    for y in [y_kminus1, y_k, -y_k]:
+        assert (bigmodel._sign_switched(y_k, y)
+                == bigmodel._sign_switched_numba(y_k, y))
@@ -1,5 +1,7 @@
 import numpy as np
 
+import maxentropy.utils
+import maxentropy.scipy.utils
 from maxentropy.utils import dictsample
 
 def test_dictsample():
@@ -13,3 +15,11 @@ def test_dictsample():
 		assert xi in samplefreq.keys()
 
 
+def test_innerprodtranspose():
+	rng = np.random.RandomState(0)
+	A = rng.normal(size=(7, 5))
+	v = rng.normal(size=7)
+	big = rng.normal(size=(14, 10))
+	for utils in [maxentropy.utils, maxentropy.scipy.utils]:
+		for B in [A, np.asfortranarray(A), big[::2, ::2]]:
+			assert np.allclose(utils.innerprodtranspose(B, v), B.T.dot(v))
@@ -0,0 +1,34 @@
+"""Tests for the auxiliary samplers in maxentropy.samplers.
+"""
+
+import numpy as np
+import scipy.stats
+
+import maxentropy
+from maxentropy.samplers import (fast_exponential, exponential_sampler,
+                                 _exponential_from_uniform)
+
+
+def test_fast_exponential():
+    rng = np.random.RandomState(0)
+    xs, log_q_xs = fast_exponential(10**5, scale=2.0, random_state=rng)
+    assert np.all(xs >= 0)
+    assert np.allclose(log_q_xs, scipy.stats.expon(scale=2.0).logpdf(xs))
+    assert abs(xs.mean() - 2.0) < 0.05
+
+    # NumPy fallback
+    u = np.random.RandomState(0).random_sample(10**5)
+    xs2, log_q_xs2 = _exponential_from_uniform(u, 2.0)
+    assert np.allclose(xs, xs2)
+    assert np.allclose(log_q_xs, log_q_xs2)
+
+
+def test_exponential_sampler_bigmodel():
+    # The maxent density on [0, inf) with mean 1 is exp(theta x) / Z with
+    # theta = -1
+    sampler = exponential_sampler(10**5, scale=2.0,
+                                  random_state=np.random.RandomState(1))
+    model = maxentropy.BigModel([lambda x: x], sampler, format='ndarray')
+    model.fit(np.atleast_2d([1.0]))
+    assert np.allclose(model.expectations(), [1.0])
+    assert abs(model.params[0] - (-1.0)) < 0.05
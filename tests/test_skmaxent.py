@@ -0,0 +1,47 @@
+"""Tests for the Monte Carlo estimators of MCMinDivergenceModel.
+"""
+
+import numpy as np
+import scipy.stats
+from scipy.special import logsumexp
+
+from maxentropy import MCMinDivergenceModel
+
+
+auxiliary = scipy.stats.norm(loc=0.0, scale=2.0)
+
+
+def make_model(seed=0):
+    rng = np.random.RandomState(seed)
+    def sampler():
+        xs = auxiliary.rvs(size=1000, random_state=rng)
+        return xs, auxiliary.logpdf(xs)
+    return MCMinDivergenceModel([lambda x: x, lambda x: x**2], sampler,
+                                vectorized=True, matrix_format='ndarray')
+
+
+def test_mcmindivergence_expectations():
+    model = make_model()
+    model.setparams([0.1, -0.1])
+    mu = model.expectations()
+
+    # The explicit (self-normalized) importance sampling estimate
+    F = model.sample_F
+    logv = F.T.dot(model.params) - model.sample_log_probs
+    n = len(logv)
+    logZ = logsumexp(logv) - np.log(n)
+    assert np.isclose(model.log_norm_constant(), logZ)
+    assert np.allclose(mu, F.dot(np.exp(logv - logZ)) / n)
+
+
+def test_mcmindivergence_matrixtrials():
+    model = make_model()
+    model.matrixtrials = 3
+    model.setparams([0.1, -0.1])
+    mu = model.expectations()
+    assert mu.shape == (2,)
+    assert model.varE.shape == (2,)
+    assert np.all(model.varE > 0)
+    # Roughly E X = 0.1 / 0.2 and E X^2 = 1 / 0.2 + 0.25 for the model
+    # N(0.5, 5)
+    assert np.allclose(mu, [0.5, 5.25], atol=0.5)